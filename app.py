@@ -20,16 +20,26 @@ import dash
 from dash import dcc
 from dash import html
 from dash import dash_table
-from plotly.subplots import make_subplots
-from dash.dependencies import Input, Output, State
+from dash.dependencies import ClientsideFunction, Input, Output, State
 import dash_bootstrap_components as dbc
-import plotly.graph_objs as go
 import dash_uploader as du
 import numpy as np
 import os
 import re
 import uuid
+import hashlib
+import json
+import multiprocessing
+import tempfile
+import threading
+import time
+import zipfile
 import vaex
+import flask
+from collections import OrderedDict
+from urllib.parse import urlencode
+from concurrent.futures import ProcessPoolExecutor
+from dash.exceptions import PreventUpdate
 
 app = dash.Dash(
     __name__, meta_tags=[{"name": "viewport", "content": "width=device-width"}]
@@ -45,7 +55,7 @@ def get_upload_component(id):
         max_file_size=1000,
         filetypes=['csv'],
         upload_id=uuid.uuid1(),  # Unique session id
-        text='Drag and Drop Here to upload CSV 📥 ',
+        text='Drag and Drop Here to upload CSV files 📥 ',
         text_completed='✔️ Uploaded: ',
         text_disabled='The uploader is disabled.',
         cancel_button=True,
@@ -53,7 +63,7 @@ def get_upload_component(id):
         disabled=False,
         chunk_size=1000,
         default_style=None,
-        max_files=1,
+        max_files=MAX_MODEL_FILES,
     )
 
 # DAE file loader and its settings
@@ -65,7 +75,7 @@ def get_upload_component2(id):
         max_file_size=1000,  # 1800 Mb
         filetypes=['dae'],
         upload_id=uuid.uuid1(),  # Unique session id
-        text='Drag and Drop Here to upload DAE 📥',
+        text='Drag and Drop Here to upload DAE files 📥',
         text_completed='✔️ Uploaded: ',
         text_disabled='The uploader is disabled.',
         cancel_button=True,
@@ -73,7 +83,7 @@ def get_upload_component2(id):
         disabled=False,
         chunk_size=1000,
         default_style=None,
-        max_files=1,
+        max_files=MAX_MODEL_FILES,
     )
 
 
@@ -87,6 +97,914 @@ UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), "uploads")
 UPLOAD_FOLDER_ROOT = UPLOAD_FOLDER
 du.configure_upload(app, UPLOAD_FOLDER_ROOT)
 
+# Preloaded datasets (CSV and DAE) and the folder for their filtered DAE files
+PRELOADED = {
+    'H1': ('/var/www/qto/data/1house.csv', '/var/www/qto/data/1house.dae'),
+    'H2': ('/var/www/qto/data/6house.csv', '/var/www/qto/data/6house.dae'),
+}
+PRELOADED_OUTPUT_FOLDER = Path(
+    '/var/www/qto/uploads/421169a4-46b0-11ec-a3ea-a9e6df576ad3')
+
+# A project can be split into linked models (architecture, structure, MEP...),
+# each uploaded as a CSV/DAE pair with the same file name
+MAX_MODEL_FILES = 10
+
+# Column tagging each element with its source model. Square brackets are not
+# allowed in Revit parameter names, so it cannot collide with a CSV column
+MODEL_COLUMN = '[Model]'
+
+# Restricting loading data from the first "nrows" of each model table
+MAX_MODEL_ROWS = 10000
+
+# Ingest mode of the CSV tables: "compact" reads only the columns used by the
+# takeoff, stores strings as categoricals and the volumetric parameters as
+# QUANTITY_DTYPE ('float32' halves their memory, sums are still computed in
+# float64); "full" reads all the columns
+INGEST_MODE = 'compact'
+QUANTITY_DTYPE = 'float64'
+ID_COLUMN = 'Unnamed: 0'
+
+# Reporting the saving of the compact ingest. The memory of the full table is
+# estimated from its first INGEST_REPORT_SAMPLE_ROWS rows, read a second time
+INGEST_REPORT_MEMORY = True
+INGEST_REPORT_SAMPLE_ROWS = 500
+
+# Number of ingested models kept in memory
+MODEL_CACHE_SIZE = 16
+
+# Reports of the takeoff that can be downloaded: the grouped aggregates and the
+# list of the grouped elements. Elements are written EXPORT_CHUNK_ROWS rows at a
+# time and files are sent in blocks of EXPORT_BLOCK_SIZE bytes
+EXPORT_REPORTS = ['groups', 'elements']
+EXPORT_FORMATS = ['csv', 'xlsx', 'parquet']
+EXPORT_CHUNK_ROWS = 50000
+EXPORT_BLOCK_SIZE = 1024 * 1024
+
+# Number of takeoff results kept in memory, and the time in seconds for which
+# browsers may reuse the results of the preloaded datasets without revalidating
+RESULTS_CACHE_SIZE = 64
+RESULTS_MAX_AGE = 3600
+
+# Fields of the zone and level filter (meters, z is the elevation), the number
+# of spatial indexes of DAE files kept in memory and the number of elements
+# whose boxes are transformed at a time when an index is built
+BOX_FIELDS = ['xmin', 'ymin', 'zmin', 'xmax', 'ymax', 'zmax']
+SPATIAL_INDEX_CACHE_SIZE = 16
+SPATIAL_INDEX_CHUNK_ROWS = 50000
+
+# Rotations of the DAE coordinates to the vertical axis z, for each up axis of
+# COLLADA: Y_UP (x, y, z) -> (x, -z, y) and X_UP (x, y, z) -> (-y, -z, x)
+DAE_UP_AXES = {
+    'Z_UP': np.identity(3),
+    'Y_UP': np.array([[1, 0, 0], [0, 0, -1], [0, 1, 0]]),
+    'X_UP': np.array([[0, -1, 0], [0, 0, -1], [1, 0, 0]]),
+}
+
+# Evaluation of the regular expression while it is typed: a request waits
+# REGEX_DEBOUNCE seconds and is dropped if a newer request of the same session
+# has arrived. The elements matched by the last expression of SESSION_CACHE_SIZE
+# sessions are kept to refine them when the expression is extended
+REGEX_DEBOUNCE = 0.3
+SESSION_CACHE_SIZE = 128
+
+# Paths of the files uploaded in the session, at most MAX_MODEL_FILES
+
+
+def get_uploaded_files(filenames, upload_id):
+    if upload_id:
+        root_folder = Path(UPLOAD_FOLDER_ROOT) / upload_id
+    else:
+        root_folder = Path(UPLOAD_FOLDER_ROOT)
+    return [root_folder / filename for filename in (filenames or [])[:MAX_MODEL_FILES]]
+
+# CSV files of the selected preloaded dataset or of the uploaded models
+
+
+def get_csv_files(valuedd, filenames, upload_id):
+    if valuedd in PRELOADED:
+        return [PRELOADED[valuedd][0]]
+    return get_uploaded_files(filenames, upload_id)
+
+# DAE files of the selected preloaded dataset or of the uploaded models
+
+
+def get_dae_files(valuedd, filenames2, upload_id2):
+    if valuedd in PRELOADED:
+        return [PRELOADED[valuedd][1]]
+    return get_uploaded_files(filenames2, upload_id2)
+
+# The source model of a file is its name without extension, e.g. "AR_House"
+
+
+def get_model_name(file):
+    return Path(file).stem
+
+# Matching DAE files to the models by file name. A single CSV and a single DAE
+# are always a pair, whatever their names
+
+
+def pair_dae_files(models, dae_files):
+    if len(models) == 1 and len(dae_files) == 1:
+        return {models[0]: dae_files[0]}
+    dae_by_model = {get_model_name(filedae): filedae for filedae in dae_files}
+    return {model: dae_by_model[model] for model in models if model in dae_by_model}
+
+#  Fetching only numbers from string values of volumetric parameters
+
+
+def find_number(text):
+    num = re.findall(r'[0-9]+', text)
+    return ".".join(num)
+
+# Reading one model: elements of the CSV table tagged with their source model.
+# In the "compact" ingest mode only the id, the volumetric parameters and the
+# grouping columns are read
+
+
+def read_model(file, nrows=MAX_MODEL_ROWS, columns=(), mode=None):
+    if (mode or INGEST_MODE) == 'compact':
+        df = read_model_compact(file, nrows, columns)
+        df[MODEL_COLUMN] = pd.Categorical([get_model_name(file)] * len(df))
+    else:
+        df = read_model_full(file, nrows)
+        df[MODEL_COLUMN] = get_model_name(file)
+    return df
+
+# Reading the whole CSV table of the model
+
+
+def read_model_full(file, nrows=MAX_MODEL_ROWS):
+    df = pd.read_csv(file, low_memory=False, nrows=nrows)
+
+    # Forming a copy of columns for string values
+    for el in propstr:
+        try:
+            df[el+'_str'] = df[el]
+            df[el+'_str'] = df[el+'_str'].fillna(0)
+            df[el+'_str'] = df[el+'_str'].astype(str)
+        except:
+            pass
+
+    # Converting volumetric parameters to numbers
+    for el in propstr:
+        try:
+            df[el] = df[el].astype(str)
+            df[el] = df[el].apply(lambda x: find_number(x))
+            df[el] = df[el].fillna(0)
+            df[el] = pd.to_numeric(df[el], errors='coerce')
+            df[el] = df[el].replace(np.nan, 0)
+            df[el] = df[el].replace('None', 0)
+            df[el] = df[el].fillna(0)
+        except:
+            pass
+        try:
+            df[el] = df[el].astype(float)
+        except:
+            pass
+    return df
+
+# Reading only the columns required for the takeoff. String values are stored
+# as categoricals, so the "_str" copy of a volumetric parameter is the
+# categorical of its original values, and the numbers are parsed once for each
+# distinct value instead of once for each element
+
+
+def read_model_compact(file, nrows=MAX_MODEL_ROWS, columns=()):
+    strcols = set(propstr) | set(columns)
+    usecols = strcols | {ID_COLUMN}
+    df = pd.read_csv(file, nrows=nrows, usecols=lambda col: col in usecols,
+                     dtype={col: 'category' for col in strcols})
+
+    # Sorted categories keep the groups in the same order as string values
+    for col in df.columns:
+        if df[col].dtype == 'category':
+            df[col] = df[col].cat.set_categories(
+                df[col].cat.categories.sort_values())
+
+    for el in propstr:
+        if el not in df.columns:
+            continue
+        values = df[el]
+        if '0' not in values.cat.categories:
+            values = values.cat.add_categories('0')
+        values = values.fillna('0')
+        numbers = pd.to_numeric(
+            values.cat.categories.map(find_number), errors='coerce')
+        numbers = np.nan_to_num(np.asarray(numbers, dtype=QUANTITY_DTYPE))
+        df[el+'_str'] = values
+        df[el] = numbers[values.cat.codes]
+    return df
+
+# Memory occupied by the table, in bytes
+
+
+def memory_footprint(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+# Reading a model together with its memory footprint (bytes) before and after
+# the compact ingest. "Before" is the footprint of the full table, scaled from a
+# sample of its first rows when INGEST_REPORT_MEMORY is on
+
+
+def ingest_model(file, nrows=MAX_MODEL_ROWS, columns=()):
+    df = read_model(file, nrows, columns)
+    if INGEST_MODE == 'compact' and INGEST_REPORT_MEMORY:
+        sample = read_model(file, min(nrows, INGEST_REPORT_SAMPLE_ROWS), mode='full')
+        footprint_full = memory_footprint(sample) * len(df) // max(len(sample), 1)
+    else:
+        footprint_full = memory_footprint(df)
+    return df, footprint_full
+
+# In-memory LRU caches (ingested models, spatial indexes, takeoff results) are
+# shared by the request threads of the server, their changes hold a lock
+cache_lock = threading.Lock()
+
+
+def cache_get(cache, key):
+    with cache_lock:
+        if key not in cache:
+            return None
+        cache.move_to_end(key)
+        return cache[key]
+
+
+def cache_put(cache, key, value, size):
+    with cache_lock:
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > size:
+            cache.popitem(last=False)
+
+# Ingested models are kept in memory, the key includes the modification time
+# of the file so that a new upload with the same name is read again
+model_cache = OrderedDict()
+
+
+def get_model_key(file, nrows, columns):
+    return (str(file), os.path.getmtime(file), nrows, tuple(sorted(columns)), INGEST_MODE, QUANTITY_DTYPE)
+
+# Process pool reading the models of a project in parallel, created on first
+# use. Its workers are spawned: forking the threads of the server can deadlock
+ingest_pool = None
+ingest_pool_lock = threading.Lock()
+
+
+def get_ingest_pool():
+    global ingest_pool
+    with ingest_pool_lock:
+        if ingest_pool is None:
+            ingest_pool = ProcessPoolExecutor(
+                max_workers=min(MAX_MODEL_FILES, os.cpu_count() or 1),
+                mp_context=multiprocessing.get_context('spawn'))
+    return ingest_pool
+
+# Reading all models of the project in parallel on the process pool and merging
+# them into one table. Returns the table and its memory footprint (bytes)
+# before and after the compact ingest
+
+
+def read_models(files, nrows=MAX_MODEL_ROWS, columns=()):
+    files = [str(file) for file in files]
+    columns = [col for col in columns if col]
+    keys = [get_model_key(file, nrows, columns) for file in files]
+    models = [cache_get(model_cache, key) for key in keys]
+    missing = [file for file, model in zip(files, models) if model is None]
+    if len(missing) > 1:
+        ingested = list(get_ingest_pool().map(ingest_model, missing, [
+                        nrows] * len(missing), [columns] * len(missing)))
+    else:
+        ingested = [ingest_model(file, nrows, columns) for file in missing]
+    ingested = dict(zip(missing, ingested))
+    for i, (file, key) in enumerate(zip(files, keys)):
+        if models[i] is None:
+            models[i] = ingested[file]
+            cache_put(model_cache, key, models[i], MODEL_CACHE_SIZE)
+
+    df = pd.concat([model[0] for model in models],
+                   ignore_index=True, sort=False)
+    # Categoricals of different models are merged as strings, they are
+    # converted back to categoricals of the whole project
+    if INGEST_MODE == 'compact':
+        for col in df.columns:
+            if df[col].dtype == object:
+                df[col] = df[col].astype('category')
+    footprint = memory_footprint(df)
+    if INGEST_MODE == 'compact' and INGEST_REPORT_MEMORY:
+        footprint_full = sum(model[1] for model in models)
+    else:
+        footprint_full = footprint
+    return df, footprint_full, footprint
+
+# Grouping the merged elements of all models in one pass: sums per model and
+# group, from which the totals per group are derived
+
+
+def aggregate_groups(df, dd_groupval, dd_propv):
+    df = df.assign(**{dd_propv: df[dd_propv].astype('float64'),
+                      dd_propv + '_str': df[dd_propv + '_str'].astype(str)})
+    df_model_groups = df.groupby([MODEL_COLUMN, dd_groupval], observed=True).agg(**{
+        'Separate ' + dd_propv + ' of elements': (dd_propv + '_str', 'sum'),
+        'Number of elements': (dd_propv, 'count'),
+        'Sum of the ' + dd_propv: (dd_propv, 'sum'),
+    }).sort_index()
+    df_groups = df_model_groups.groupby(level=dd_groupval, observed=True).agg(
+        {col: 'sum' for col in df_model_groups.columns}).sort_index()
+    return df_model_groups.reset_index(), df_groups.reset_index()
+
+# Message about the selected dataset: its size and memory footprint before and
+# after the compact ingest
+
+
+def get_dataset_message(valuedd, df, footprint_full, footprint):
+    message = 'You have selected dataset "{}": {:,} elements'.format(
+        valuedd, len(df))
+    models = df[MODEL_COLUMN].nunique()
+    if models > 1:
+        message += ' of {} models'.format(models)
+    message += ', {:.1f} MB in memory'.format(footprint / 2**20)
+    if footprint_full != footprint:
+        message += ' (about {:.1f} MB before compact ingest)'.format(
+            footprint_full / 2**20)
+    return message
+
+# Table of the takeoff: totals per group and, for several models, the groups of
+# each model followed by the model subtotal
+
+
+def get_takeoff_table(df_model_groups, df_groups, dd_groupval):
+    if df_model_groups[MODEL_COLUMN].nunique() < 2:
+        return df_groups
+    tables = [df_groups.assign(**{MODEL_COLUMN: 'All models'})]
+    for model, df_model in df_model_groups.groupby(MODEL_COLUMN, sort=False, observed=True):
+        subtotal = df_model.drop(columns=[MODEL_COLUMN, dd_groupval]).agg(
+            {col: 'sum' for col in df_groups.columns if col != dd_groupval})
+        subtotal[dd_groupval] = 'Subtotal'
+        subtotal[MODEL_COLUMN] = model
+        tables.append(df_model)
+        tables.append(subtotal.to_frame().T)
+    df_table = pd.concat(tables, ignore_index=True)
+    return df_table[[MODEL_COLUMN] + list(df_groups.columns)]
+
+# Ids of the grouped elements of each model, only the models with grouped
+# elements are listed
+
+
+def get_group_ids(df, group_mask):
+    df_group_byword = df[group_mask].rename(columns={ID_COLUMN: 'id'})
+    group_ids_str = {}
+    for model, df_model in df_group_byword.groupby(MODEL_COLUMN, sort=False, observed=True):
+        group_ids_str[model] = [str(el) for el in df_model.id.values]
+    return group_ids_str
+
+# Removing from the DAE file all geometry except the elements with the given ids
+# and saving the result to filedaena
+
+
+def filter_dae(filedae, group_ids_str, filedaena):
+    # Start sorting geometry from DAE file
+    fileObject = open(filedae, "r")
+    ET.register_namespace(
+        "", "http://www.collada.org/2005/11/COLLADASchema")
+    tree = ET.parse(fileObject)
+
+    # Formation of a data tree from the DAE format
+    root = tree.getroot()
+    geom_list = []
+
+    # If the ID of an element from the group_ids_str list that was found earlier matches,
+    # all elements with this ID are found in the DAE file, and all other elements are deleted
+    for node in root.findall('.//{http://www.collada.org/2005/11/COLLADASchema}node'):
+        if node.attrib['id'] in group_ids_str:
+            url = list(node)[0].get('url')
+            geom_list.append(url[1:])
+        else:
+            try:
+                nd = node.find(
+                    '{http://www.collada.org/2005/11/COLLADASchema}instance_geometry')
+                node.remove(nd)
+            except:
+                0
+    for geomet in root.findall('.//{http://www.collada.org/2005/11/COLLADASchema}geometry'):
+        if geomet.attrib['id'] in geom_list:
+            0
+        else:
+            md = geomet.find(
+                '{http://www.collada.org/2005/11/COLLADASchema}mesh')
+            geomet.remove(md)
+    with open(filedaena, 'w') as f:
+        tree.write(f, encoding='unicode')
+
+# Reading the bounding boxes of the elements from the DAE file. The file is
+# parsed as a stream: the box of each geometry is computed from its vertex
+# positions, and the transforms of the nodes (matrix, translate, rotate, scale)
+# are accumulated down the node tree. Returns the ids of the elements and the
+# minimum and maximum corners of their boxes in meters, with the vertical axis
+# last
+
+
+def read_dae_boxes(filedae):
+    ns = '{http://www.collada.org/2005/11/COLLADASchema}'
+    geom_boxes = {}
+    instances = []
+    transforms = [np.identity(4)]
+    node_ids = []
+    tags = []
+    unit = 1.0
+    up_axis = 'Z_UP'
+    for event, elem in ET.iterparse(filedae, events=('start', 'end')):
+        tag = elem.tag.replace(ns, '')
+        if event == 'start':
+            tags.append(tag)
+            if tag == 'node':
+                transforms.append(transforms[-1])
+                node_ids.append(elem.get('id'))
+            continue
+        tags.pop()
+        parent = tags[-1] if tags else None
+        if tag == 'unit':
+            unit = float(elem.get('meter', 1.0))
+        elif tag == 'up_axis':
+            up_axis = (elem.text or 'Z_UP').strip()
+        elif parent == 'node' and tag in ('matrix', 'translate', 'rotate', 'scale'):
+            transforms[-1] = transforms[-1] @ get_dae_transform(
+                tag, np.fromstring(elem.text or '', sep=' '))
+        elif parent == 'node' and tag == 'instance_geometry':
+            instances.append(
+                (node_ids[-1], elem.get('url', '')[1:], transforms[-1]))
+        elif tag == 'node':
+            transforms.pop()
+            node_ids.pop()
+            elem.clear()
+        elif tag == 'geometry':
+            box = get_geometry_box(elem, ns)
+            if box is not None:
+                geom_boxes[elem.get('id')] = box
+            elem.clear()
+
+    instances = [(node_id, geom_boxes[url], matrix)
+                 for node_id, url, matrix in instances if node_id and url in geom_boxes]
+    if not instances:
+        return np.array([], dtype=object), np.zeros((0, 3)), np.zeros((0, 3))
+    ids = np.array([instance[0] for instance in instances], dtype=object)
+    mins = np.empty((len(instances), 3))
+    maxs = np.empty((len(instances), 3))
+
+    # The 8 corners of each box are transformed to the world coordinates with
+    # the vertical axis z, a chunk of elements at a time
+    up = DAE_UP_AXES.get(up_axis, DAE_UP_AXES['Z_UP'])
+    corners = np.stack(np.meshgrid([0, 1], [0, 1], [0, 1], indexing='ij'),
+                       axis=-1).reshape(8, 3)
+    for start in range(0, len(instances), SPATIAL_INDEX_CHUNK_ROWS):
+        chunk = instances[start:start + SPATIAL_INDEX_CHUNK_ROWS]
+        boxes = np.array([instance[1] for instance in chunk])
+        matrices = np.array([instance[2] for instance in chunk])
+        points = np.where(corners[None, :, :] == 0,
+                          boxes[:, None, 0, :], boxes[:, None, 1, :])
+        points = np.einsum('nij,nkj->nki', matrices[:, :3, :3], points) + \
+            matrices[:, None, :3, 3]
+        points = points @ up.T
+        mins[start:start + len(chunk)] = points.min(axis=1) * unit
+        maxs[start:start + len(chunk)] = points.max(axis=1) * unit
+    return ids, mins, maxs
+
+# 4x4 matrix of a COLLADA transform element
+
+
+def get_dae_transform(tag, values):
+    transform = np.identity(4)
+    if tag == 'matrix':
+        transform = values.reshape(4, 4)
+    elif tag == 'translate':
+        transform[:3, 3] = values[:3]
+    elif tag == 'scale':
+        transform[:3, :3] = np.diag(values[:3])
+    elif tag == 'rotate':
+        axis = values[:3] / (np.linalg.norm(values[:3]) or 1.0)
+        angle = np.radians(values[3])
+        cross = np.array([[0, -axis[2], axis[1]],
+                          [axis[2], 0, -axis[0]],
+                          [-axis[1], axis[0], 0]])
+        transform[:3, :3] = np.identity(3) + np.sin(angle) * cross + \
+            (1 - np.cos(angle)) * cross @ cross
+    return transform
+
+# Box (minimum and maximum corners) of the vertex positions of a geometry
+
+
+def get_geometry_box(geometry, ns):
+    mesh = geometry.find(ns + 'mesh')
+    if mesh is None:
+        return None
+    position = mesh.find(ns + 'vertices/' + ns + 'input[@semantic="POSITION"]')
+    source = None
+    if position is not None:
+        source_id = position.get('source', '')[1:]
+        source = mesh.find(ns + 'source[@id="' + source_id + '"]')
+    if source is None:
+        source = mesh.find(ns + 'source')
+    float_array = source.find(ns + 'float_array') if source is not None else None
+    if float_array is None or not float_array.text:
+        return None
+    points = np.fromstring(float_array.text, sep=' ')
+    points = points[:len(points) // 3 * 3].reshape(-1, 3)
+    if not len(points):
+        return None
+    return np.array([points.min(axis=0), points.max(axis=0)])
+
+# Spatial index of the DAE elements: the centres of their boxes sorted by x, so
+# that a query only checks the elements in the x range of the box
+
+
+def build_spatial_index(filedae):
+    ids, mins, maxs = read_dae_boxes(filedae)
+    centres = (mins + maxs) / 2
+    order = np.argsort(centres[:, 0], kind='stable')
+    return {
+        'ids': ids[order],
+        'numeric_ids': pd.to_numeric(pd.Series(ids[order], dtype=object), errors='coerce').to_numpy(),
+        'centres': centres[order],
+    }
+
+# Positions in the index of the elements whose box centre lies in the box
+# (xmin, ymin, zmin, xmax, ymax, zmax), in meters, z is the elevation. None is
+# an open bound
+
+
+def query_spatial_index(index, box):
+    lo = np.array([-np.inf if v is None else v for v in box[:3]])
+    hi = np.array([np.inf if v is None else v for v in box[3:]])
+    centres = index['centres']
+    start = np.searchsorted(centres[:, 0], lo[0], side='left')
+    end = np.searchsorted(centres[:, 0], hi[0], side='right')
+    candidates = centres[start:end]
+    inside = (candidates[:, 1] >= lo[1]) & (candidates[:, 1] <= hi[1]) & \
+        (candidates[:, 2] >= lo[2]) & (candidates[:, 2] <= hi[2])
+    return start + np.flatnonzero(inside)
+
+# Spatial indexes are built once for each DAE file and kept in memory. A request
+# that needs an index being built by another one waits for it on the lock of
+# the file instead of building it again
+spatial_index_cache = OrderedDict()
+spatial_index_builds = {}
+
+
+def get_spatial_index(filedae):
+    key = (str(filedae), os.path.getmtime(filedae))
+    index = cache_get(spatial_index_cache, key)
+    if index is not None:
+        return index
+    with cache_lock:
+        build_lock = spatial_index_builds.setdefault(key, threading.Lock())
+    try:
+        with build_lock:
+            index = cache_get(spatial_index_cache, key)
+            if index is None:
+                index = build_spatial_index(filedae)
+                cache_put(spatial_index_cache, key, index, SPATIAL_INDEX_CACHE_SIZE)
+    finally:
+        with cache_lock:
+            spatial_index_builds.pop(key, None)
+    return index
+
+# Box of the zone and level filter from the values of its fields, None if the
+# filter is not set
+
+
+def get_box(values):
+    box = tuple(None if v in (None, '') else float(v) for v in values)
+    if all(v is None for v in box):
+        return None
+    return box
+
+# Box of the zone and level filter written as text, e.g. ",,3.0,,,6.0", and back.
+# Text that is not a box gives no box
+
+
+def format_box(box):
+    return ','.join('' if v is None else repr(v) for v in box) if box else ''
+
+
+def parse_box(text):
+    values = (text or '').split(',')
+    if len(values) != len(BOX_FIELDS):
+        return None
+    try:
+        return get_box(values)
+    except ValueError:
+        return None
+
+# Keeping only the selected elements whose box centre lies in the zone and level
+# box. Elements of models without a DAE file cannot be located and are dropped
+
+
+def apply_box_filter(df, group_mask, box, model_dae_files):
+    box_mask = np.zeros(len(df), dtype=bool)
+    group_rows = group_mask.to_numpy()
+    for model, filedae in model_dae_files.items():
+        index = get_spatial_index(filedae)
+        found = query_spatial_index(index, box)
+        positions = np.flatnonzero(
+            group_rows & (df[MODEL_COLUMN] == model).to_numpy())
+        element_ids = df[ID_COLUMN].iloc[positions]
+        if pd.api.types.is_numeric_dtype(element_ids):
+            inside = element_ids.isin(index['numeric_ids'][found])
+        else:
+            inside = element_ids.astype(str).isin(index['ids'][found])
+        box_mask[positions[inside.to_numpy()]] = True
+    return pd.Series(box_mask, index=df.index)
+
+# Selecting the elements whose value in the grouping column matches the regular
+# expression entered by the user
+
+
+def select_elements(df, dd_groupval, regexq, candidates=None):
+    if candidates is None:
+        return df[dd_groupval].str.match('.'+regexq) == True
+
+    # Only the rows at the positions "candidates" are matched
+    values = df[dd_groupval].iloc[candidates]
+    group_mask = np.zeros(len(df), dtype=bool)
+    group_mask[candidates[(values.str.match('.'+regexq) == True).to_numpy()]] = True
+    return pd.Series(group_mask, index=df.index)
+
+# Keeping only the selected elements located in the box of the zone and level
+# filter, if it is set
+
+
+def select_in_box(df, group_mask, box=None, dae_files=()):
+    if box:
+        model_dae_files = pair_dae_files(list(df[MODEL_COLUMN].unique()), dae_files)
+        group_mask = apply_box_filter(df, group_mask, box, model_dae_files)
+    return group_mask
+
+# Selecting the elements of the takeoff: matching the regular expression and,
+# if the zone and level filter is set, located in its box
+
+
+def select_takeoff(df, dd_groupval, regexq, box=None, dae_files=()):
+    return select_in_box(df, select_elements(df, dd_groupval, regexq), box, dae_files)
+
+# Requests of the takeoff of each session (the id of the browser tab). A newer
+# request supersedes the ones still being evaluated, they stop at the next check
+session_requests = OrderedDict()
+session_lock = threading.Lock()
+
+
+def start_request(session_id):
+    if not session_id:
+        return None
+    with session_lock:
+        token = session_requests.pop(session_id, 0) + 1
+        session_requests[session_id] = token
+        while len(session_requests) > SESSION_CACHE_SIZE:
+            session_requests.popitem(last=False)
+    return token
+
+
+def check_request(session_id, token):
+    # A session evicted from the table has no newer request
+    if session_id and session_requests.get(session_id, token) != token:
+        raise PreventUpdate
+
+# An expression extended by letters, digits, spaces and separators matches a
+# subset of the elements matched by the expression before it, unless it ends
+# with an escape (e.g. "\1" + "0") or is not complete yet (e.g. "[wW" + "all")
+LITERAL_SUFFIX = re.compile(r'[\w \-,.:;/]*')
+
+
+def is_refinement(previous, regexq):
+    if not regexq.startswith(previous) or not LITERAL_SUFFIX.fullmatch(regexq[len(previous):]):
+        return False
+    if re.search(r'\\\w*$', previous):
+        return False
+    try:
+        re.compile('.'+previous)
+    except re.error:
+        return False
+    return True
+
+# Elements matched by the last regular expression of each session, as the key of
+# the dataset and of the grouping column, the expression and the matched rows
+session_matches = OrderedDict()
+
+
+def select_session_elements(session_id, key, df, dd_groupval, regexq):
+    last = session_matches.get(session_id) if session_id else None
+    candidates = None
+    if last and last[0] == key and is_refinement(last[1], regexq):
+        candidates = last[2]
+    group_mask = select_elements(df, dd_groupval, regexq, candidates)
+    if session_id:
+        with session_lock:
+            session_matches.pop(session_id, None)
+            session_matches[session_id] = (key, regexq, np.flatnonzero(
+                group_mask.to_numpy()).astype(np.int32))
+            while len(session_matches) > SESSION_CACHE_SIZE:
+                session_matches.popitem(last=False)
+    return group_mask
+
+# Aggregated results of the groups sent to the browser, which renders the
+# charts and the table from them
+
+
+def get_takeoff_results(df, group_mask, dd_groupval, dd_propv, regexq):
+    df_model_groups, df_groups = aggregate_groups(
+        df[group_mask], dd_groupval, dd_propv)
+    df_table = get_takeoff_table(df_model_groups, df_groups, dd_groupval)
+    return {
+        'group': dd_groupval,
+        'prop': dd_propv,
+        'regex': regexq,
+        'labels': df_groups[dd_groupval].astype(str).tolist(),
+        'counts': df_groups['Number of elements'].astype(int).tolist(),
+        'sums': df_groups['Sum of the ' + dd_propv].astype(float).tolist(),
+        'table': json.loads(df_table.to_json(orient='split', index=False)),
+    }
+
+# Key of the takeoff results, it changes when a file of the dataset is replaced
+# or when the ingest settings change. Also used as the ETag of the results
+
+
+def get_results_key(files, dd_groupval, dd_propv, regexq, box=None, dae_files=()):
+    if box:
+        files = list(files) + list(dae_files)
+    stats = [(str(file), os.path.getmtime(file), os.path.getsize(file))
+             for file in files]
+    key = repr((stats, dd_groupval, dd_propv, regexq, format_box(box),
+                MAX_MODEL_ROWS, INGEST_MODE, QUANTITY_DTYPE))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+# Takeoff results already computed for the same dataset and filters are reused
+results_cache = OrderedDict()
+
+
+def cached_results(key, compute):
+    results = cache_get(results_cache, key)
+    if results is None:
+        results = compute()
+        cache_put(results_cache, key, results, RESULTS_CACHE_SIZE)
+    return results
+
+# Letters and digits of the regular expression, used in the names of the files
+# with the grouped elements
+
+
+def get_regex_name(regexq):
+    words_pattern = '[a-zA-Z10-9]+'
+    regw = re.findall(words_pattern, regexq, flags=re.IGNORECASE)
+    regwn = ''
+    for el in regw:
+        regwn = regwn + el
+    return regwn
+
+# Chunks of the report: the takeoff table of the groups, which is small, or the
+# list of the grouped elements, taken from the cached dataset EXPORT_CHUNK_ROWS
+# rows at a time
+
+
+def iter_report_chunks(report, df, group_mask, dd_groupval, dd_propv):
+    if report == 'groups':
+        df_model_groups, df_groups = aggregate_groups(
+            df[group_mask], dd_groupval, dd_propv)
+        yield get_takeoff_table(df_model_groups, df_groups, dd_groupval)
+        return
+    columns = [MODEL_COLUMN, ID_COLUMN, dd_groupval] + \
+        [el for el in propstr if el in df.columns and el != dd_groupval]
+    positions = np.flatnonzero(group_mask.to_numpy())
+    for start in range(0, max(len(positions), 1), EXPORT_CHUNK_ROWS):
+        chunk = df.iloc[positions[start:start + EXPORT_CHUNK_ROWS]][columns]
+        yield chunk.rename(columns={ID_COLUMN: 'id'})
+
+# Writing the chunks of the report as CSV text, the header goes with the first one
+
+
+def stream_csv(chunks):
+    header = True
+    for chunk in chunks:
+        yield chunk.to_csv(index=False, header=header)
+        header = False
+
+# XLSX files can only be written to a file: the chunks are written one by one
+# to a temporary file on disk, which is then sent in blocks and deleted
+
+
+def stream_file(write, chunks):
+    fd, path = tempfile.mkstemp(prefix='qto_export_')
+    os.close(fd)
+    try:
+        write(chunks, path)
+        with open(path, 'rb') as f:
+            while True:
+                block = f.read(EXPORT_BLOCK_SIZE)
+                if not block:
+                    break
+                yield block
+    finally:
+        os.remove(path)
+
+# Writing the chunks to XLSX, in the constant memory mode of XlsxWriter each row
+# is flushed to disk as soon as the next one is started
+
+
+def write_xlsx(chunks, path):
+    import xlsxwriter
+
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+    worksheet = workbook.add_worksheet('Takeoff')
+    row = 0
+    for chunk in chunks:
+        if row == 0:
+            worksheet.write_row(row, 0, list(chunk.columns))
+            row += 1
+        chunk = chunk.astype(object).where(chunk.notna(), None)
+        for values in chunk.itertuples(index=False):
+            worksheet.write_row(row, 0, values)
+            row += 1
+    workbook.close()
+
+# Write-only file object that keeps the written bytes until they are taken
+
+
+class StreamBuffer:
+
+    def __init__(self):
+        self.blocks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.blocks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self.blocks)
+        self.blocks = []
+        return data
+
+# Streaming the chunks as Parquet, one row group for each chunk: the bytes of
+# each row group are sent as soon as it is written, the footer goes last
+
+
+def stream_parquet(chunks):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sink = StreamBuffer()
+    writer = None
+    for chunk in chunks:
+        if writer is None:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            writer = pq.ParquetWriter(sink, table.schema)
+        else:
+            table = pa.Table.from_pandas(
+                chunk, schema=writer.schema, preserve_index=False)
+        writer.write_table(table)
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+# Response bodies and content types of the report formats
+EXPORT_WRITERS = {
+    'csv': (stream_csv, 'text/csv'),
+    'xlsx': (lambda chunks: stream_file(write_xlsx, chunks),
+             'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'parquet': (stream_parquet, 'application/octet-stream'),
+}
+
+# Address of the cacheable takeoff results of a preloaded dataset
+
+
+def get_results_url(valuedd, dd_groupval, dd_propv, regexq, box=None):
+    return '/results/{}?{}'.format(valuedd, urlencode({
+        'group': dd_groupval, 'prop': dd_propv, 'regex': regexq, 'box': format_box(box)}))
+
+# Links to download the reports of the current takeoff
+
+
+def get_export_links(valuedd, filenames, upload_id, filenames2, upload_id2, dd_groupval, dd_propv, regexq, box=None):
+    query = urlencode({'dataset': valuedd, 'upload_id': upload_id or '',
+                       'file': filenames or [], 'dae_upload_id': upload_id2 or '',
+                       'dae': filenames2 or [], 'group': dd_groupval,
+                       'prop': dd_propv, 'regex': regexq, 'box': format_box(box)}, doseq=True)
+    links = ['📥 Download report: ']
+    for report, title in [('groups', 'groups'), ('elements', 'elements')]:
+        links.append(title + ' ')
+        for fmt in EXPORT_FORMATS:
+            links.append(html.A(fmt.upper(), href='/export/{}.{}?{}'.format(report, fmt, query),
+                                style={'margin-right': '10px'}))
+    return html.Div(links, style={'font-size': '14px', 'margin-left': '70px'})
+
+
 # App Layout
 app.layout = html.Div(
     children=[
@@ -265,6 +1183,29 @@ app.layout = html.Div(
 
                                 ], style={"margin-top": "20px", }),
 
+                                html.Div([
+                                    html.H5("📐 Zone and level, m"),
+                                ] + [
+                                    dbc.InputGroup(
+                                        [
+                                            dbc.InputGroupText(label),
+                                            dbc.Input(id=field_min, type="number", debounce=True,
+                                                      placeholder="from", style={'font-size': '16px'}),
+                                            dbc.Input(id=field_max, type="number", debounce=True,
+                                                      placeholder="to", style={'font-size': '16px'}),
+                                        ], style={"margin-bottom": "5px"},
+                                    ) for label, field_min, field_max in [
+                                        ('Elevation', 'zmin', 'zmax'),
+                                        ('X', 'xmin', 'xmax'),
+                                        ('Y', 'ymin', 'ymax')]
+                                ] + [
+                                    html.H6(
+                                        children='elements whose bounding box centre in the DAE geometry lies in the box',
+                                        style={'font-size': '13px',
+                                               "padding-top": "5px"}
+                                    ),
+                                ], style={"margin-top": "20px", }),
+
                                 html.H5(children='🧮 Aggregated for the group', style={
                                         "padding-top": "25px"}),
                                 html.Div([
@@ -282,7 +1223,7 @@ app.layout = html.Div(
                                             'font-size': '13px',  "padding-left": "5px", "padding-top": "5px"}
                                     ),
                                     html.H6(
-                                        children='🧾 To reduce the load on the server, the number of items that are unloaded from CSV is limited to the first 10,000 items',
+                                        children='🧾 To reduce the load on the server, the number of items that are unloaded from each CSV is limited to the first 10,000 items',
                                         style={
                                             'font-size': '15px',  "padding-left": "5px", "padding-top": "5px"}
                                     ),
@@ -340,6 +1281,26 @@ app.layout = html.Div(
                     children=[
                         html.Div(id="element-to-hide_h",
                                  children=[
+                                     html.Div(id="export-links"),
+                                     html.Div([
+                                         html.Span('Order of groups: ', style={
+                                             'margin-right': '10px'}),
+                                         dcc.RadioItems(
+                                             id='groups-order',
+                                             options=[
+                                                 {'label': 'by name',
+                                                  'value': 'name'},
+                                                 {'label': 'by number of elements',
+                                                  'value': 'count'},
+                                                 {'label': 'by sum',
+                                                  'value': 'sum'}
+                                             ],
+                                             value='name',
+                                             labelStyle={
+                                                 'display': 'inline-block', 'margin-right': '15px'},
+                                             style={'display': 'inline-block'},
+                                         ),
+                                     ], style={'font-size': '14px', 'margin-left': '70px'}),
                                      html.Div(
                                          children=[
                                              dcc.Graph(id="plot"),
@@ -364,12 +1325,29 @@ app.layout = html.Div(
                         ),
                     ]),
                 dcc.Store(id="error", storage_type="memory"),
+                dcc.Store(id="takeoff-results", storage_type="memory"),
+                dcc.Store(id="session-id", storage_type="memory"),
+                dcc.Store(id="csv-files", storage_type="memory"),
+                dcc.Store(id="dae-files", storage_type="memory"),
             ],
         ),
     ]
 )
 
 
+# Names of the files uploaded by the tab. The uploader only reports the files of
+# its last drag and drop, so they are added to the ones uploaded before
+for uploader, store in [('dash-uploader', 'csv-files'), ('dash-uploader2', 'dae-files')]:
+    app.clientside_callback(
+        ClientsideFunction(namespace='qto', function_name='add_uploaded_files'),
+        Output(store, "data"),
+        Input(uploader, "isCompleted"),
+        State(uploader, "fileNames"),
+        State(uploader, "maxFiles"),
+        State(store, "data"),
+    )
+
+
 # Callback to download CSV file
 @app.callback(
     [
@@ -377,34 +1355,23 @@ app.layout = html.Div(
         Output("containerb", "children"),
     ],
     [
-        Input('dash-uploader', 'isCompleted'),
+        Input('csv-files', 'data'),
         Input('hf-dropdown', 'value'),
     ],
     [
-        State('dash-uploader', 'fileNames'),
         State('dash-uploader', 'upload_id')
     ],
 )
-def update_error(iscompleted, valuedd, filenames, upload_id):
-
-    if filenames is not None:
-        if upload_id:
-            root_folder = Path(UPLOAD_FOLDER_ROOT) / upload_id
-        else:
-            root_folder = Path(UPLOAD_FOLDER_ROOT)
+def update_error(filenames, valuedd, upload_id):
 
-        for filename in filenames:
-            file = root_folder / filename
     # If a predefined dataset is selected in the dropdown menu - use it
-    if valuedd == 'H1':
-        file = '/var/www/qto/data/1house.csv'
-    elif valuedd == 'H2':
-        file = '/var/www/qto/data/6house.csv'
-    else:
-        pass
+    files = get_csv_files(valuedd, filenames, upload_id)
+    if not files:
+        raise PreventUpdate
 
     # Formation of options for selection in the filtering settings module
-    dfi = pd.read_csv(file, low_memory=False, error_bad_lines=False, nrows=10)
+    dfi = pd.concat([pd.read_csv(file, low_memory=False, error_bad_lines=False, nrows=10)
+                     for file in files], ignore_index=True, sort=False)
     onlycat = dfi['Category'].unique()
     dfi['Category'].unique()
     onlycat = np.insert(onlycat, 0, 'All categories')
@@ -440,28 +1407,19 @@ def update_error(iscompleted, valuedd, filenames, upload_id):
 @app.callback(
     [Output("containerfilename", "value"),
      ],
-    [Input('dash-uploader2', 'isCompleted'), Input('hf-dropdown', 'value'), ],
-    [State('dash-uploader2', 'fileNames'),
-     State('dash-uploader2', 'upload_id')],
+    [Input('dae-files', 'data'), Input('hf-dropdown', 'value'), ],
+    [State('dash-uploader2', 'upload_id')],
 
 )
-def update_error2(iscompleted2, valuedd, filenames2, upload_id2):
-    if filenames2 is not None:
-        if upload_id2:
-            root_folder2 = Path(UPLOAD_FOLDER_ROOT) / upload_id2
-        else:
-            root_folder2 = Path(UPLOAD_FOLDER_ROOT)
-
-        for filename2 in filenames2:
-            filedae = root_folder2 / filename2
+def update_error2(filenames2, valuedd, upload_id2):
 
-    # If a predefined dataset is selected in the dropdown menu - use it
-    if valuedd == 'H1':
-        filedae = '/var/www/qto/data/1house.dae'
-    elif valuedd == 'H2':
-        filedae = '/var/www/qto/data/6house.dae'
-    else:
-        pass
+    # The spatial index of each DAE file (uploaded or of the predefined dataset)
+    # is built here, so that the zone and level filter does not wait for it
+    for filedae in get_dae_files(valuedd, filenames2, upload_id2):
+        try:
+            get_spatial_index(filedae)
+        except (OSError, ET.ParseError):
+            pass
     return [str('filedae')]
 
 
@@ -470,338 +1428,240 @@ def update_error2(iscompleted2, valuedd, filenames2, upload_id2):
     [
         Output("download-dae", "data"),
         Output('dd-output-container', 'children'),
-        Output("plot", "figure"),
-        Output("plot2", "figure"),
-        Output("plot3", "figure"),
+        Output("takeoff-results", "data"),
         Output("elementhide", "style"),
         Output("element-to-hide_h", "style"),
         Output("elementhide2", "style"),
-        Output("divbutt", "children")],
+        Output("divbutt", "children"),
+        Output("export-links", "children")],
     [
         Input("dd_groupval", "value"),
         Input("dd_propv", "value"),
         Input('regexq', 'value'),
-        Input('dash-uploader', 'isCompleted'),
+        Input('csv-files', 'data'),
         Input('containerfilename', 'value'),
         Input('dash-uploader2', 'isCompleted2'),
         Input("btn-download-txt", "n_clicks"),
         Input('hf-dropdown', 'value'),
-    ],
+    ] + [Input(field, 'value') for field in BOX_FIELDS],
     [
-        State('dash-uploader', 'fileNames'),
         State('dash-uploader', 'upload_id'),
-        State('dash-uploader2', 'fileNames'),
-        State('dash-uploader2', 'upload_id')
+        State('dae-files', 'data'),
+        State('dash-uploader2', 'upload_id'),
+        State('session-id', 'data')
     ], prevent_initial_call=True,
 )
-def update_output(dd_groupval, dd_propv, regexq, iscompleted, filedae, iscompleted2, n_clicks, valuedd, filenames, upload_id, filenames2, upload_id2):
+def update_output(dd_groupval, dd_propv, regexq, filenames, filedae, iscompleted2, n_clicks, valuedd, xmin, ymin, zmin, xmax, ymax, zmax, upload_id, filenames2, upload_id2, session_id):
+    triggered = [trigger['prop_id'] for trigger in dash.callback_context.triggered]
 
-    # File upload check
-    try:
-        if upload_id:
-            root_folder = Path(UPLOAD_FOLDER_ROOT) / upload_id
-        else:
-            root_folder = Path(UPLOAD_FOLDER_ROOT)
+    # While the regular expression is typed, only the last keystroke is evaluated,
+    # and a newer request of the session cancels this one at the next check
+    token = start_request(session_id)
+    if 'regexq.value' in triggered:
+        time.sleep(REGEX_DEBOUNCE)
+    check_request(session_id, token)
 
-        for filename in filenames:
-            file = root_folder / filename
-    except:
-        pass
+    # File upload check, if a predefined dataset is selected - use it
+    files = get_csv_files(valuedd, filenames, upload_id)
+    if not files:
+        raise PreventUpdate
 
-    # Formation of a graph, if there is no data to display
-    fig_none = go.Figure()
-    fig_none.add_trace(go.Scatter(
-        x=[0, 1, 2, 3, 4, 5, 6, 7, 8, 10],
-        y=[0, 4, 5, 1, 2, 3, 2, 4, 2, 1],
-        mode="lines+markers+text",
-        text=["", "", "", "", "no items found", "", "", "", "", ''],
-        textfont_size=40,
-    ))
-    fig_none.update_layout(
-        paper_bgcolor='#fff',
-        plot_bgcolor='#fff'
-    )
-    fig_none.update_layout(
-        xaxis=dict(
-            showgrid=False,
-            gridcolor='#fff',
-            zerolinecolor='#fff'),
-        yaxis=dict(
-            showgrid=False,
-            gridcolor='#fff',
-            zerolinecolor='#fff'))
-
-    if valuedd == 'H1':
-        file = '/var/www/qto/data/1house.csv'
-    elif valuedd == 'H2':
-        file = '/var/www/qto/data/6house.csv'
-    else:
-        pass
+    # Reading all models of the project into one table
+    df, footprint_full, footprint = read_models(files, columns=[dd_groupval])
+    message = get_dataset_message(valuedd, df, footprint_full, footprint)
+    dae_files = get_dae_files(valuedd, filenames2, upload_id2)
+    box = get_box([xmin, ymin, zmin, xmax, ymax, zmax])
+    check_request(session_id, token)
 
-    # Restricting loading data from the first "nrows" of a table
-    dfi = pd.read_csv(file, low_memory=False, nrows=10000)
-    df = dfi
+    # Checking the condition if something will be found with Regex and in the
+    # zone and level box. An extended expression refines the elements matched
+    # by the previous one, an incomplete one keeps the previous results
+    match_key = get_results_key(files, dd_groupval, None, None)
+    try:
+        group_mask = select_session_elements(session_id, match_key, df, dd_groupval, regexq)
+    except re.error:
+        raise PreventUpdate
+    group_mask = select_in_box(df, group_mask, box, dae_files)
+    check_request(session_id, token)
+    if group_mask.any():
+        export_links = get_export_links(valuedd, filenames, upload_id, filenames2,
+                                        upload_id2, dd_groupval, dd_propv, regexq, box)
 
-    # Forming a copy of columns for string values
-    for el in propstr:
-        try:
-            df[el+'_str'] = df[el]
-            df[el+'_str'] = df[el+'_str'].fillna(0)
-            df[el+'_str'] = df[el+'_str'].astype(str)
-        except:
-            pass
+        # Grouping by a regular expression that was entered by the user,
+        # across all models at once with the subtotals of each model. The
+        # browser fetches the results of a preloaded dataset from its HTTP cache,
+        # they are computed here so that the "/results" route is already warm
+        results = cached_results(get_results_key(files, dd_groupval, dd_propv, regexq, box, dae_files),
+                                 lambda: get_takeoff_results(df, group_mask, dd_groupval, dd_propv, regexq))
+        if valuedd in PRELOADED:
+            results = {'url': get_results_url(valuedd, dd_groupval, dd_propv, regexq, box)}
 
-    #  Fetching only numbers from string values of volumetric parameters
-    def find_number(text):
-        num = re.findall(r'[0-9]+', text)
-        return ".".join(num)
-    for el in propstr:
-        try:
-            df[el] = df[el].astype(str)
-            df[el] = df[el].apply(lambda x: find_number(x))
-            df[el] = df[el].fillna(0)
-            df[el] = pd.to_numeric(df[el], errors='coerce')
-            df[el] = df[el].replace(np.nan, 0)
-            df[el] = df[el].replace('None', 0)
-            df[el] = df[el].fillna(0)
-        except:
-            pass
-        try:
-            df[el] = df[el].astype(float)
-        except:
-            pass
+        # Find all element ids of each model that have been grouped by regular expression
+        group_ids_str = get_group_ids(df, group_mask)
 
-    # Checking the condition if something will be found with Regex
-    if not df[df[dd_groupval].str.match('.'+regexq) == True].empty:
-
-        # Grouping by a regular expression that was entered by the user
-        df_group_byword = df[df[dd_groupval].str.match('.'+regexq) == True]
-        df_groups_wall = df_group_byword.groupby(
-            [dd_groupval])[dd_propv].agg(['sum', 'count'])
-        df_groups_wall.columns = [
-            ''.join(str(i) for i in col) for col in df_groups_wall.columns]
-        df_groups_wall = df_groups_wall.rename(
-            {'sum': 'Sum of the Areas', 'count': 'Number of elements'}, axis=1)
-        df_groups_wall.reset_index(inplace=True)
-        df_group_byword = df_group_byword.rename(columns={'Unnamed: 0': 'id'})
-
-        # Grouping string values by a regular expression that was entered by the user
-        df_group_byword2 = df[df[dd_groupval].str.match('.'+regexq) == True]
-        df_groups_wall2 = df_group_byword.groupby(
-            [dd_groupval])[dd_propv+"_str"].agg(['sum', 'count'])
-        df_groups_wall2 = df_groups_wall2.rename(
-            {'sum': 'Separate ' + dd_propv + ' of elements', 'count': 'Number of elements'}, axis=1)
-        df_groups_wall2.reset_index(inplace=True)
-        df_group_byword2 = df_group_byword2.rename(
-            columns={'Unnamed: 0': 'id'})
-        df_groups_wall2['Sum of the ' +
-                        dd_propv] = df_groups_wall['Sum of the Areas']
-        group_ids = df_group_byword.id.values
-
-        # Find all element ids that have been grouped by regular expression
-        group_ids_str = []
-        for el in group_ids:
-            group_ids_str.append(str(el))
-
-        # Formation of a table for displaying data of grouped elements
-        fig3 = go.Figure(data=[go.Table(
-            header=dict(values=list(df_groups_wall2.columns),
-                        line_color='darkslategray',
-                        fill_color='lightskyblue',
-                        align='left'),
-            cells=dict(values=df_groups_wall2.values.T,
-                       fill_color='lavender',
-                       align='left'))
-        ])
-        fig3.update_layout(width=1000, height=500,
-                           margin=dict(l=70, r=30, t=0, b=0),
-                           paper_bgcolor='#fff',
-                           plot_bgcolor='#fff',)
-
-        # Formation of pie chart for displaying data of grouped elements
-        fig2 = make_subplots(rows=1, cols=2, specs=[
-                             [{'type': 'domain'}, {'type': 'domain'}]])
-        fig2.add_trace(go.Pie(labels=df_groups_wall[dd_groupval], values=df_groups_wall["Number of elements"], name="Quantity, PCS"),
-                       1, 1)
-        fig2.add_trace(go.Pie(labels=df_groups_wall[dd_groupval], values=df_groups_wall["Sum of the Areas"], name=dd_propv),
-                       1, 2)
-
-        fig2.update_layout(
-            annotations=[dict(text='Quantity', x=0.15, y=0.5, font_size=20, showarrow=False),
-                         dict(text=dd_propv, x=0.84, y=0.5, font_size=20, showarrow=False)],
-            paper_bgcolor='#fff',
-            plot_bgcolor='#fff',
-            margin=dict(l=150, r=150, t=50, b=100),
-            height=370,)
-
-        # Form a bar chart to display the data of grouped members
-        fig = make_subplots(rows=1, cols=2, specs=[
-                            [{}, {}]], shared_xaxes=True, shared_yaxes=False, vertical_spacing=0.001)
-        fig.append_trace(go.Bar(
-            x=df_groups_wall["Number of elements"],
-            y=df_groups_wall[dd_groupval],
-            marker=dict(
-                color='rgba(50, 171, 96, 0.6)',
-                line=dict(color='rgba(50, 171, 96, 1.0)', width=3),),
-            name='The number of elements in a group',
-            orientation='h',
-        ), 1, 1)
-        fig.append_trace(go.Bar(
-            x=df_groups_wall["Sum of the Areas"],
-            y=df_groups_wall[dd_groupval],
-            marker=dict(
-                color='rgba(58, 71, 80, 0.6)',
-                line=dict(color='rgba(58, 71, 80, 1.0)', width=3),),
-            name=dd_propv + ' value in the group',
-            orientation='h',
-        ), 1, 2)
-        fig.update_layout(
-            title='Number and ' + dd_propv + ' of grouped elements by ' +
-            dd_groupval + ' and expression' + regexq,
-            yaxis=dict(
-                showgrid=False,
-                showline=True,
-                showticklabels=True,
-                domain=[0, 0.85],
-            ),
-            yaxis2=dict(
-                showgrid=False,
-                showline=True,
-                showticklabels=False,
-                linecolor='rgba(102, 102, 102, 0.8)',
-                domain=[0, 0.85],
-            ),
-            xaxis=dict(
-                zeroline=False,
-                showline=False,
-                showticklabels=True,
-                showgrid=True,
-                domain=[0, 0.42],
-                side='top',
-            ),
-            xaxis2=dict(
-                zeroline=False,
-                showline=False,
-                showticklabels=True,
-                showgrid=True,
-                domain=[0.47, 1],
-                side='top',
-            ),
-            legend=dict(x=0.029, y=1.1, font_size=10),
-            margin=dict(l=70, r=20, t=80, b=30),
-            paper_bgcolor='#fff',
-            plot_bgcolor='#fff',
-            height=370,
-        )
-
-        # Adding annotations
-        annotations = []
-        y_s = np.round(df_groups_wall["Number of elements"], decimals=2)
-        y_nw = np.rint(df_groups_wall["Sum of the Areas"])
-
-        # Adding labels
-        for ydn, yd, xd in zip(y_nw, y_s, df_groups_wall[dd_groupval]):
-
-            annotations.append(dict(xref='x2', yref='y2',
-                                    y=xd, x=ydn,
-                                    text='{:,}'.format(ydn),
-                                    font=dict(family='Arial', size=12,
-                                              color='rgb(128, 0, 128)'),
-                                    showarrow=False))
-            # labeling the bar net worth
-            annotations.append(dict(xref='x1', yref='y1',
-                                    y=xd, x=yd,
-                                    text=str(yd) + ' PCS.',
-                                    font=dict(family='Arial', size=12,
-                                              color='rgb(50, 171, 96)'),
-                                    showarrow=False))
-        fig.update_layout(annotations=annotations)
-
-    # In the absence of data, show the fig_none
+    # In the absence of data, the charts show "no items found"
     else:
-
-        fig = fig_none
-        fig2 = fig_none
-        fig3 = fig_none
+        results = None
+        group_ids_str = {}
+        export_links = ''
     try:
-        try:
-            if upload_id2:
-                root_folder2 = Path(UPLOAD_FOLDER_ROOT) / upload_id2
-            else:
-                root_folder2 = Path(UPLOAD_FOLDER_ROOT)
-            for filename2 in filenames2:
-                filedae = root_folder2 / filename2
-        except:
-            pass
-        if valuedd == 'H1':
-            filedae = '/var/www/qto/data/1house.dae'
-        elif valuedd == 'H2':
-            filedae = '/var/www/qto/data/6house.dae'
+        model_dae_files = pair_dae_files(list(group_ids_str), dae_files)
+        if not model_dae_files:
+            raise FileNotFoundError('No DAE file for the grouped elements')
+
+        # Formation of a new name for the DAE file with grouped elements
+        regwn = get_regex_name(regexq)
+        if valuedd in PRELOADED:
+            root_folder2 = PRELOADED_OUTPUT_FOLDER
+        elif upload_id2:
+            root_folder2 = Path(UPLOAD_FOLDER_ROOT) / upload_id2
         else:
-            pass
+            root_folder2 = Path(UPLOAD_FOLDER_ROOT)
 
-        # Start sorting geometry from DAE file
-        fileObject = open(filedae, "r")
-        ET.register_namespace(
-            "", "http://www.collada.org/2005/11/COLLADASchema")
-        tree = ET.parse(fileObject)
-
-        # Formation of a data tree from the DAE format
-        root = tree.getroot()
-        geom_list = []
-
-        # If the ID of an element from the group_ids_str list that was found earlier matches,
-        # all elements with this ID are found in the DAE file, and all other elements are deleted
-        for node in root.findall('.//{http://www.collada.org/2005/11/COLLADASchema}node'):
-            if node.attrib['id'] in group_ids_str:
-                url = list(node)[0].get('url')
-                geom_list.append(url[1:])
-            else:
-                try:
-                    nd = node.find(
-                        '{http://www.collada.org/2005/11/COLLADASchema}instance_geometry')
-                    node.remove(nd)
-                except:
-                    0
-        for geomet in root.findall('.//{http://www.collada.org/2005/11/COLLADASchema}geometry'):
-            if geomet.attrib['id'] in geom_list:
-                0
-            else:
-                md = geomet.find(
-                    '{http://www.collada.org/2005/11/COLLADASchema}mesh')
-                geomet.remove(md)
+        # Names of the DAE files of each model with its grouped elements
+        filedaenas = [root_folder2 / (regwn + '_' + Path(filedae).name)
+                      for filedae in model_dae_files.values()]
 
-        # Formation of a new name for the DAE file with grouped elements
-        words_pattern = '[a-zA-Z10-9]+'
-        regw = re.findall(words_pattern, regexq, flags=re.IGNORECASE)
-        regwn = ''
-        for el in regw:
-            regwn = regwn + el
-        if valuedd == 'H1':
-            filename2 = '1house.dae'
-            root_folder2 = Path(
-                '/var/www/qto/uploads/421169a4-46b0-11ec-a3ea-a9e6df576ad3')
-        elif valuedd == 'H2':
-            filename2 = '6house.dae'
-            root_folder2 = Path(
-                '/var/www/qto/uploads/421169a4-46b0-11ec-a3ea-a9e6df576ad3')
+        # Geometry of several models is downloaded as one archive
+        if len(filedaenas) == 1:
+            filename2nn = filedaenas[0].name
         else:
-            pass
-        filename2nn = regwn + '_' + filename2
+            filename2nn = regwn + '_project.zip'
         filedaena = root_folder2 / filename2nn
-        with open(filedaena, 'w') as f:
-            tree.write(f, encoding='unicode')
-        if n_clicks > 1:
-            return dcc.send_file(filedaena), 'You have selected "{}"'.format(valuedd), fig, fig2, fig3, {'display': 'block'}, {'display': 'block'}, {'display': 'none'}, html.Div([html.Button("📤 Download DAE geometry "+filename2nn, id="btn-download-txt", n_clicks=n_clicks+1)])
+
+        # The DAE files are filtered by the ids of the grouped elements only
+        # when the download button is pressed
+        if 'btn-download-txt.n_clicks' in triggered and n_clicks:
+            for model, filedae in model_dae_files.items():
+                filter_dae(filedae, group_ids_str[model],
+                           root_folder2 / (regwn + '_' + Path(filedae).name))
+            check_request(session_id, token)
+            if len(filedaenas) > 1:
+                with zipfile.ZipFile(filedaena, 'w', zipfile.ZIP_DEFLATED) as zf:
+                    for filedaena_model in filedaenas:
+                        zf.write(filedaena_model, filedaena_model.name)
+            return dcc.send_file(filedaena), message, results, {'display': 'block'}, {'display': 'block'}, {'display': 'none'}, html.Div([html.Button("📤 Download DAE geometry "+filename2nn, id="btn-download-txt", n_clicks=n_clicks+1)]), export_links
             n_clicks = 0
         else:
-            return ['', 'You have selected dataset "{}"'.format(valuedd), fig, fig2, fig3, {'display': 'block'}, {'display': 'block'}, {'display': 'none'}, html.Div([html.Button("📤 Download DAE geometry "+filename2nn, id="btn-download-txt", n_clicks=n_clicks+1)])]
+            return ['', message, results, {'display': 'block'}, {'display': 'block'}, {'display': 'none'}, html.Div([html.Button("📤 Download DAE geometry "+filename2nn, id="btn-download-txt", n_clicks=n_clicks+1)]), export_links]
+    except PreventUpdate:
+        raise
     except:
-        return ["", 'You have selected dataset "{}"'.format(valuedd), fig, fig2, fig3, {'display': 'none'}, {'display': 'block'}, {'display': 'none'},
+        return ["", message, results, {'display': 'none'}, {'display': 'block'}, {'display': 'none'},
                 html.Div(
-                    [html.Button("Download D2a", id="btn-download-txt", n_clicks=0)])
+                    [html.Button("Download D2a", id="btn-download-txt", n_clicks=0)]),
+                export_links
                 ]
 
 
+# Rendering the charts and the table in the browser from the aggregated results,
+# changing only their presentation does not call the server
+app.clientside_callback(
+    ClientsideFunction(namespace='qto', function_name='render_takeoff'),
+    [
+        Output("plot", "figure"),
+        Output("plot2", "figure"),
+        Output("plot3", "figure")],
+    [
+        Input("takeoff-results", "data"),
+        Input("groups-order", "value"),
+    ],
+)
+
+# Id of the page, generated on each load and kept only in memory, so that a
+# duplicated tab gets its own id and does not cancel the requests of the first
+app.clientside_callback(
+    ClientsideFunction(namespace='qto', function_name='session_id'),
+    Output("session-id", "data"),
+    Input("session-id", "modified_timestamp"),
+    State("session-id", "data"),
+)
+
+
+# Takeoff results of a preloaded dataset with HTTP caching: they only change
+# with the files of the dataset, so the browser revalidates them with the ETag
+
+
+@server.route('/results/<dataset>')
+def takeoff_results(dataset):
+    if dataset not in PRELOADED:
+        flask.abort(404)
+    args = flask.request.args
+    files = get_csv_files(dataset, [], None)
+    dae_files = get_dae_files(dataset, [], None)
+    dd_groupval = args.get('group', 'Type')
+    dd_propv = args.get('prop', propstr[1])
+    regexq = args.get('regex', '')
+    box = parse_box(args.get('box'))
+
+    try:
+        etag = get_results_key(files, dd_groupval, dd_propv,
+                               regexq, box, dae_files)
+    except FileNotFoundError:
+        flask.abort(404)
+    if flask.request.if_none_match.contains(etag):
+        response = flask.Response(status=304)
+    else:
+        def compute():
+            df = read_models(files, columns=[dd_groupval])[0]
+            if dd_groupval not in df.columns or dd_propv not in df.columns:
+                flask.abort(400)
+            try:
+                group_mask = select_takeoff(
+                    df, dd_groupval, regexq, box, dae_files)
+            except re.error:
+                flask.abort(400)
+            if not group_mask.any():
+                return None
+            return get_takeoff_results(df, group_mask, dd_groupval, dd_propv, regexq)
+        try:
+            response = flask.jsonify(cached_results(etag, compute))
+        except FileNotFoundError:
+            flask.abort(404)
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = RESULTS_MAX_AGE
+    return response
+
+
+# Streamed download of the reports of the takeoff, the parameters are the same
+# as in the filters of the app
+
+
+@server.route('/export/<report>.<fmt>')
+def export_report(report, fmt):
+    if report not in EXPORT_REPORTS or fmt not in EXPORT_FORMATS:
+        flask.abort(404)
+    args = flask.request.args
+    filenames = [Path(filename).name for filename in args.getlist('file')]
+    upload_id = Path(args.get('upload_id', '')).name
+    files = get_csv_files(args.get('dataset'), filenames, upload_id)
+    if not files:
+        flask.abort(404)
+    filenames2 = [Path(filename).name for filename in args.getlist('dae')]
+    upload_id2 = Path(args.get('dae_upload_id', '')).name
+    dae_files = get_dae_files(args.get('dataset'), filenames2, upload_id2)
+    dd_groupval = args.get('group', 'Type')
+    dd_propv = args.get('prop', propstr[1])
+    regexq = args.get('regex', '')
+    box = parse_box(args.get('box'))
+
+    try:
+        df = read_models(files, columns=[dd_groupval])[0]
+        if dd_groupval not in df.columns or dd_propv not in df.columns:
+            flask.abort(400)
+        group_mask = select_takeoff(df, dd_groupval, regexq, box, dae_files)
+    except FileNotFoundError:
+        flask.abort(404)
+    except re.error:
+        flask.abort(400)
+
+    chunks = iter_report_chunks(report, df, group_mask, dd_groupval, dd_propv)
+    write, mimetype = EXPORT_WRITERS[fmt]
+    filename = '{}_{}.{}'.format(get_regex_name(regexq) or 'all', report, fmt)
+    return flask.Response(flask.stream_with_context(write(chunks)), mimetype=mimetype,
+                          headers={'Content-Disposition': 'attachment; filename="{}"'.format(filename)})
+
+
 if __name__ == "__main__":
     app.run_server(host='93.188.165.241', port=8050,  use_reloader=True,)
@@ -0,0 +1,222 @@
+// Rendering of the charts and the table of the takeoff in the browser.
+// The server only sends the aggregated results of the groups (dcc.Store
+// "takeoff-results"), so presentation changes do not need a server request.
+
+// Graph with a message, if there is no data to display
+function figMessage(message) {
+    return {
+        data: [{
+            type: 'scatter',
+            x: [0, 1, 2, 3, 4, 5, 6, 7, 8, 10],
+            y: [0, 4, 5, 1, 2, 3, 2, 4, 2, 1],
+            mode: 'lines+markers+text',
+            text: ['', '', '', '', message, '', '', '', '', ''],
+            textfont: {size: 40},
+        }],
+        layout: {
+            paper_bgcolor: '#fff',
+            plot_bgcolor: '#fff',
+            xaxis: {showgrid: false, gridcolor: '#fff', zerolinecolor: '#fff'},
+            yaxis: {showgrid: false, gridcolor: '#fff', zerolinecolor: '#fff'},
+        },
+    };
+}
+
+function figNone() {
+    return figMessage('no items found');
+}
+
+// Order of the groups in the charts: by name (as sent by the server), by the
+// number of elements or by the sum of the property
+function orderGroups(results, order) {
+    var index = results.labels.map(function (label, i) { return i; });
+    if (order === 'count') {
+        index.sort(function (a, b) { return results.counts[a] - results.counts[b]; });
+    } else if (order === 'sum') {
+        index.sort(function (a, b) { return results.sums[a] - results.sums[b]; });
+    }
+    return {
+        labels: index.map(function (i) { return results.labels[i]; }),
+        counts: index.map(function (i) { return results.counts[i]; }),
+        sums: index.map(function (i) { return results.sums[i]; }),
+    };
+}
+
+// Python formatting '{:,}' of a rounded float, e.g. "1,234.0"
+function formatSum(value) {
+    return Math.round(value).toLocaleString('en-US') + '.0';
+}
+
+// Bar chart to display the data of grouped members
+function barFigure(results, groups) {
+    var annotations = [];
+    groups.labels.forEach(function (label, i) {
+        var sum = Math.round(groups.sums[i]);
+        annotations.push({
+            xref: 'x2', yref: 'y2', y: label, x: sum, text: formatSum(sum),
+            font: {family: 'Arial', size: 12, color: 'rgb(128, 0, 128)'},
+            showarrow: false,
+        });
+        // labeling the bar net worth
+        annotations.push({
+            xref: 'x', yref: 'y', y: label, x: groups.counts[i],
+            text: groups.counts[i] + ' PCS.',
+            font: {family: 'Arial', size: 12, color: 'rgb(50, 171, 96)'},
+            showarrow: false,
+        });
+    });
+    return {
+        data: [{
+            type: 'bar',
+            x: groups.counts,
+            y: groups.labels,
+            marker: {color: 'rgba(50, 171, 96, 0.6)', line: {color: 'rgba(50, 171, 96, 1.0)', width: 3}},
+            name: 'The number of elements in a group',
+            orientation: 'h',
+            xaxis: 'x',
+            yaxis: 'y',
+        }, {
+            type: 'bar',
+            x: groups.sums,
+            y: groups.labels,
+            marker: {color: 'rgba(58, 71, 80, 0.6)', line: {color: 'rgba(58, 71, 80, 1.0)', width: 3}},
+            name: results.prop + ' value in the group',
+            orientation: 'h',
+            xaxis: 'x2',
+            yaxis: 'y2',
+        }],
+        layout: {
+            title: {text: 'Number and ' + results.prop + ' of grouped elements by ' +
+                results.group + ' and expression' + results.regex},
+            yaxis: {anchor: 'x', showgrid: false, showline: true, showticklabels: true, domain: [0, 0.85]},
+            yaxis2: {anchor: 'x2', showgrid: false, showline: true, showticklabels: false,
+                linecolor: 'rgba(102, 102, 102, 0.8)', domain: [0, 0.85]},
+            xaxis: {anchor: 'y', zeroline: false, showline: false, showticklabels: true,
+                showgrid: true, domain: [0, 0.42], side: 'top'},
+            xaxis2: {anchor: 'y2', zeroline: false, showline: false, showticklabels: true,
+                showgrid: true, domain: [0.47, 1], side: 'top'},
+            legend: {x: 0.029, y: 1.1, font: {size: 10}},
+            margin: {l: 70, r: 20, t: 80, b: 30},
+            paper_bgcolor: '#fff',
+            plot_bgcolor: '#fff',
+            height: 370,
+            annotations: annotations,
+        },
+    };
+}
+
+// Pie chart for displaying data of grouped elements
+function pieFigure(results, groups) {
+    return {
+        data: [{
+            type: 'pie',
+            labels: groups.labels,
+            values: groups.counts,
+            name: 'Quantity, PCS',
+            domain: {x: [0, 0.45], y: [0, 1]},
+        }, {
+            type: 'pie',
+            labels: groups.labels,
+            values: groups.sums,
+            name: results.prop,
+            domain: {x: [0.55, 1], y: [0, 1]},
+        }],
+        layout: {
+            annotations: [
+                {text: 'Quantity', x: 0.15, y: 0.5, font: {size: 20}, showarrow: false},
+                {text: results.prop, x: 0.84, y: 0.5, font: {size: 20}, showarrow: false},
+            ],
+            paper_bgcolor: '#fff',
+            plot_bgcolor: '#fff',
+            margin: {l: 150, r: 150, t: 50, b: 100},
+            height: 370,
+        },
+    };
+}
+
+// Table for displaying data of grouped elements
+function tableFigure(results) {
+    var table = results.table;
+    return {
+        data: [{
+            type: 'table',
+            header: {values: table.columns, line: {color: 'darkslategray'},
+                fill: {color: 'lightskyblue'}, align: 'left'},
+            cells: {
+                values: table.columns.map(function (col, j) {
+                    return table.data.map(function (row) { return row[j]; });
+                }),
+                fill: {color: 'lavender'},
+                align: 'left',
+            },
+        }],
+        layout: {
+            width: 1000,
+            height: 500,
+            margin: {l: 70, r: 30, t: 0, b: 0},
+            paper_bgcolor: '#fff',
+            plot_bgcolor: '#fff',
+        },
+    };
+}
+
+// Results of a preloaded dataset from the "/results" route. Clientside callbacks
+// of Dash 2.0 cannot wait for a promise, so the request is synchronous; it goes
+// through the HTTP cache of the browser, which revalidates it with the ETag (a
+// response revalidated with 304 is given to the request as 200). A failed
+// request is returned as {error: status}
+function fetchResults(url) {
+    var request = new XMLHttpRequest();
+    try {
+        request.open('GET', url, false);
+        request.send();
+    } catch (e) {
+        return {error: 'network error'};
+    }
+    if (request.status !== 200) {
+        return {error: request.status};
+    }
+    return JSON.parse(request.responseText);
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    qto: {
+        render_takeoff: function (results, order) {
+            if (results && results.url) {
+                results = fetchResults(results.url);
+            }
+            if (results && results.error) {
+                var message = 'results could not be loaded (' + results.error + ')';
+                return [figMessage(message), figMessage(message), figMessage(message)];
+            }
+            if (!results) {
+                return [figNone(), figNone(), figNone()];
+            }
+            var groups = orderGroups(results, order);
+            return [barFigure(results, groups), pieFigure(results, groups), tableFigure(results)];
+        },
+        // Names of the uploaded files: the new ones are added to the names of
+        // the earlier drag and drops, up to the maximum number of files of the
+        // uploader, and a file uploaded again keeps its place
+        add_uploaded_files: function (isCompleted, fileNames, maxFiles, files) {
+            if (!isCompleted || !fileNames) {
+                return window.dash_clientside.no_update;
+            }
+            var names = (files || []).slice();
+            fileNames.forEach(function (name) {
+                if (names.indexOf(name) < 0 && names.length < maxFiles) {
+                    names.push(name);
+                }
+            });
+            return names;
+        },
+        // Id of the page, the server uses it to cancel the requests of the
+        // page that have been superseded by a newer one
+        session_id: function (timestamp, id) {
+            if (id) {
+                return window.dash_clientside.no_update;
+            }
+            return Date.now().toString(36) + '-' + Math.random().toString(36).slice(2);
+        },
+    },
+});
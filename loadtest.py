@@ -0,0 +1,488 @@
+###
+# App Name:  Load test of Quantity take-offs (QTO)
+# Description: Simulating concurrent user sessions against the Dash callbacks of the app
+#   and measuring latency, throughput and memory of the server
+# DataDrivenConstruction
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+###
+
+# Usage:
+#   python loadtest.py --sessions 10 --elements 50000
+#   python loadtest.py --server gunicorn --workers 4 --sessions 20
+#   python loadtest.py --url http://127.0.0.1:8050 --pid 12345 --dataset H1
+#
+# Each simulated session replays the requests that the browser sends to
+# /_dash-update-component: uploading a synthetic CSV/DAE pair (or selecting a
+# preloaded dataset), changing the dropdowns, typing a regular expression and
+# downloading the filtered DAE and a report. All sessions run a scenario at the
+# same time, the scenarios run one after another.
+
+import argparse
+import json
+import os
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import requests
+
+PATH = Path(__file__).parent
+
+SCENARIOS = ['upload', 'dropdown', 'regex', 'download']
+
+# Regular expressions typed in the "regex" scenario, one request per keystroke
+TYPED_PATTERNS = ['*Basic Wall*', '*[wW]indow*', '*Floor: 2*']
+
+# Types of the synthetic elements, "Category: Type name"
+SYNTHETIC_TYPES = [
+    'Walls: Basic Wall: Exterior 300', 'Walls: Basic Wall: Interior 120',
+    'Walls: Curtain Wall: CW1', 'Floors: Floor: 200mm', 'Floors: Floor: 300mm',
+    'Windows: Window: 900x1200', 'Windows: Window: 1200x1500',
+    'Doors: Door: D1 900x2100', 'Columns: Column: 400x400', 'Roofs: Roof: Flat 250',
+]
+
+# Writing a synthetic model: a BIMEXCEL-like CSV with "extra_columns" parameters
+# that the takeoff does not use, and a DAE file with a box for each element,
+# placed on "levels" storeys of 3 m
+
+
+def make_synthetic_dataset(folder, name='synthetic', elements=10000, extra_columns=50, levels=5, seed=0):
+    rng = random.Random(seed)
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    csv_file = folder / (name + '.csv')
+    dae_file = folder / (name + '.dae')
+    extra = ['Parameter {}'.format(i) for i in range(extra_columns)]
+    with open(csv_file, 'w', encoding='utf-8') as f:
+        f.write(','.join(['', 'Category', 'Type', 'Level', 'Area', 'Volume', 'Width', 'Length'] + extra) + '\n')
+        for i in range(elements):
+            category, type_name = SYNTHETIC_TYPES[i % len(SYNTHETIC_TYPES)].split(': ', 1)
+            row = [str(100000 + i), category, type_name, 'Level {}'.format(i % levels),
+                   '{:.2f} m²'.format(rng.uniform(0.5, 60)), '{:.3f} m³'.format(rng.uniform(0.05, 20)),
+                   '{} mm'.format(rng.randint(50, 500)), '{:.2f} m'.format(rng.uniform(0.5, 25))]
+            row += ['value {}'.format(rng.randint(0, 99)) for _ in extra]
+            f.write(','.join(row) + '\n')
+
+    ns = 'http://www.collada.org/2005/11/COLLADASchema'
+    side = int(np.ceil(np.sqrt(elements / levels)))
+    with open(dae_file, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n')
+        f.write('<COLLADA xmlns="{}" version="1.4.1"><asset><unit meter="1" name="meter"/>'
+                '<up_axis>Z_UP</up_axis></asset><library_geometries>'.format(ns))
+        for i in range(elements):
+            x, y, z = (i // levels) % side * 2.0, (i // levels) // side * 2.0, (i % levels) * 3.0
+            f.write('<geometry id="geom-{0}"><mesh><source id="geom-{0}-positions">'
+                    '<float_array id="geom-{0}-array" count="6">{1} {2} {3} {4} {5} {6}</float_array>'
+                    '</source><vertices id="geom-{0}-vertices"><input semantic="POSITION" source="#geom-{0}-positions"/>'
+                    '</vertices></mesh></geometry>'.format(i, x, y, z, x + 1.5, y + 1.5, z + 2.8))
+        f.write('</library_geometries><library_visual_scenes><visual_scene id="scene">')
+        for i in range(elements):
+            f.write('<node id="{}"><instance_geometry url="#geom-{}"/></node>'.format(100000 + i, i))
+        f.write('</visual_scene></library_visual_scenes></COLLADA>\n')
+    return csv_file, dae_file
+
+# Memory (RSS) of the process and all its children in bytes, from /proc. None if
+# it cannot be measured (not Linux, or no process)
+
+
+def get_process_tree_rss(pid):
+    if not pid or not os.path.isdir('/proc/{}'.format(pid)):
+        return None
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/{}/stat'.format(entry)) as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    rss = 0
+    stack = [pid]
+    while stack:
+        current = stack.pop()
+        try:
+            with open('/proc/{}/status'.format(current)) as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        rss += int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        stack.extend(children.get(current, []))
+    return rss
+
+# Sampling the memory of the server in the background during a scenario
+
+
+class MemorySampler(threading.Thread):
+
+    def __init__(self, pid, interval=0.2):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            rss = get_process_tree_rss(self.pid)
+            if rss is not None:
+                self.samples.append(rss)
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        return (max(self.samples) if self.samples else None,
+                self.samples[-1] if self.samples else None)
+
+# Starting the app locally with the Flask server or gunicorn, returns the process
+
+
+def start_server(server, port, workers):
+    if server == 'gunicorn':
+        command = [sys.executable, '-m', 'gunicorn', 'app:server', '--workers', str(workers),
+                   '--threads', '4', '--bind', '127.0.0.1:{}'.format(port), '--timeout', '300']
+    else:
+        command = [sys.executable, '-c',
+                   'import app; app.server.run(host="127.0.0.1", port={}, threaded=True)'.format(port)]
+    return subprocess.Popen(command, cwd=str(PATH), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                            start_new_session=True)
+
+
+def wait_for_server(url, timeout=180):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(url + '/_dash-layout', timeout=5).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(1)
+    raise RuntimeError('The app did not start at {}'.format(url))
+
+# Properties of all components with an id in a Dash layout (or in the children
+# returned by a callback), as {"id.property": value}
+
+
+def collect_props(layout, props=None):
+    props = {} if props is None else props
+    if isinstance(layout, list):
+        for item in layout:
+            collect_props(item, props)
+    elif isinstance(layout, dict) and 'props' in layout:
+        component_props = layout['props']
+        if isinstance(component_props.get('id'), str):
+            for name, value in component_props.items():
+                if name != 'children':
+                    props[component_props['id'] + '.' + name] = value
+        collect_props(component_props.get('children'), props)
+    return props
+
+# Callbacks of the app from /_dash-dependencies, server-side ones only
+
+
+def get_callbacks(url):
+    callbacks = []
+    for dependency in requests.get(url + '/_dash-dependencies', timeout=30).json():
+        if dependency.get('clientside_function'):
+            continue
+        output = dependency['output']
+        if output.startswith('..'):
+            outputs = output[2:-2].split('...')
+        else:
+            outputs = [output]
+        callbacks.append({
+            'output': output,
+            'outputs': [dict(zip(['id', 'property'], out.rsplit('.', 1))) for out in outputs],
+            'multi': output.startswith('..'),
+            'inputs': dependency['inputs'],
+            'state': dependency['state'],
+        })
+    return callbacks
+
+# A simulated user session: the values of the component properties as the
+# browser keeps them, and the requests of the callbacks they trigger
+
+
+class Session:
+
+    def __init__(self, url, callbacks, layout_props, dataset, files):
+        self.url = url
+        self.callbacks = callbacks
+        self.props = dict(layout_props)
+        self.dataset = dataset
+        self.files = files
+        self.http = requests.Session()
+        self.upload_id = str(uuid.uuid4())
+        # Id of the browser tab, set by a clientside callback in the browser
+        self.props['session-id.data'] = str(uuid.uuid4())
+        self.lock = threading.Lock()
+        self.timings = []
+
+    def record(self, scenario, step, started, status):
+        with self.lock:
+            self.timings.append((scenario, step, time.perf_counter() - started, status))
+
+    # Sending the callbacks triggered by the change of the property "changed"
+
+    def fire(self, scenario, changed):
+        for callback in self.callbacks:
+            if not any(changed == item['id'] + '.' + item['property'] for item in callback['inputs']):
+                continue
+            with self.lock:
+                payload = {
+                    'output': callback['output'],
+                    'outputs': callback['outputs'] if callback['multi'] else callback['outputs'][0],
+                    'inputs': [dict(item, value=self.props.get(item['id'] + '.' + item['property']))
+                               for item in callback['inputs']],
+                    'state': [dict(item, value=self.props.get(item['id'] + '.' + item['property']))
+                              for item in callback['state']],
+                    'changedPropIds': [changed],
+                }
+            started = time.perf_counter()
+            try:
+                response = self.http.post(self.url + '/_dash-update-component', json=payload, timeout=600)
+                status = response.status_code
+            except requests.RequestException:
+                self.record(scenario, changed, started, 'error')
+                continue
+            self.record(scenario, changed, started, status)
+            if status == 200:
+                self.update(response.json().get('response', {}))
+
+    # Properties returned by a callback, including the components in returned children
+
+    def update(self, response):
+        with self.lock:
+            for component_id, values in response.items():
+                for name, value in values.items():
+                    self.props[component_id + '.' + name] = value
+                    if name == 'children':
+                        collect_props(value, self.props)
+
+    def set(self, prop, value):
+        with self.lock:
+            self.props[prop] = value
+
+    # Uploading a file with the requests of dash-uploader (resumable.js)
+
+    def upload(self, scenario, file, chunk_size=50 * 1024 * 1024):
+        size = os.path.getsize(file)
+        chunks = max(1, int(np.ceil(size / chunk_size)))
+        identifier = '{}-{}'.format(size, Path(file).name.replace('.', ''))
+        started = time.perf_counter()
+        status = 200
+        with open(file, 'rb') as f:
+            for number in range(1, chunks + 1):
+                data = {'resumableChunkNumber': number, 'resumableTotalChunks': chunks,
+                        'resumableFilename': Path(file).name, 'resumableIdentifier': identifier,
+                        'upload_id': self.upload_id}
+                try:
+                    response = self.http.post(self.url + '/API/resumable', data=data,
+                                              files={'file': (Path(file).name, f.read(chunk_size))}, timeout=600)
+                    status = response.status_code
+                except requests.RequestException:
+                    status = 'error'
+                    break
+        self.record(scenario, 'upload ' + Path(file).suffix, started, status)
+
+    def download(self, scenario, path):
+        started = time.perf_counter()
+        try:
+            with self.http.get(self.url + path, stream=True, timeout=600) as response:
+                for _ in response.iter_content(1024 * 1024):
+                    pass
+                status = response.status_code
+        except requests.RequestException:
+            status = 'error'
+        self.record(scenario, path.split('?')[0], started, status)
+
+    # Scenarios
+
+    def run_upload(self):
+        if self.dataset in ('UF', None):
+            csv_file, dae_file = self.files
+            self.upload('upload', csv_file)
+            self.upload('upload', dae_file)
+            # The names of the uploaded files are kept by a clientside callback
+            self.set('dash-uploader.upload_id', self.upload_id)
+            self.set('dash-uploader2.upload_id', self.upload_id)
+            self.set('dae-files.data', [dae_file.name])
+            self.set('csv-files.data', [csv_file.name])
+            self.fire('upload', 'csv-files.data')
+        else:
+            self.set('hf-dropdown.value', self.dataset)
+            self.fire('upload', 'hf-dropdown.value')
+
+    def run_dropdown(self):
+        for prop in ['Area', 'Volume', 'Length']:
+            self.set('dd_propv.value', prop)
+            self.fire('dropdown', 'dd_propv.value')
+        for group in ['Category', 'Type']:
+            self.set('dd_groupval.value', group)
+            self.fire('dropdown', 'dd_groupval.value')
+
+    def run_regex(self, typing_interval):
+        pattern = random.choice(TYPED_PATTERNS)
+        # The browser sends a request for each keystroke without waiting for
+        # the previous one
+        with ThreadPoolExecutor(max_workers=len(pattern)) as keystrokes:
+            for i in range(1, len(pattern) + 1):
+                self.set('regexq.value', pattern[:i])
+                keystrokes.submit(self.fire, 'regex', 'regexq.value')
+                time.sleep(typing_interval)
+
+    def run_download(self):
+        self.set('btn-download-txt.n_clicks', 2)
+        self.fire('download', 'btn-download-txt.n_clicks')
+        with self.lock:
+            links = self.props.get('export-links.children') or {}
+        hrefs = [props['href'] for props in collect_links(links)]
+        elements = [href for href in hrefs if href.startswith('/export/elements.csv')]
+        if elements:
+            self.download('download', elements[0])
+
+
+def collect_links(children):
+    links = []
+    if isinstance(children, list):
+        for item in children:
+            links.extend(collect_links(item))
+    elif isinstance(children, dict) and 'props' in children:
+        if 'href' in children['props']:
+            links.append(children['props'])
+        links.extend(collect_links(children['props'].get('children')))
+    return links
+
+# Latency percentiles, throughput and memory of a scenario, for each status of
+# the responses: 200 for an evaluated request, 204 for a request dropped without
+# update (e.g. a keystroke superseded by the next one), and the errors
+
+
+def summarize(scenario, timings, elapsed, memory):
+    peak, last = memory
+    rows = []
+    for status in sorted({t[3] for t in timings}, key=str):
+        latencies = np.array([t[2] for t in timings if t[3] == status]) * 1000
+        rows.append({
+            'scenario': scenario,
+            'status': status,
+            'requests': len(latencies),
+            'p50_ms': float(np.percentile(latencies, 50)),
+            'p95_ms': float(np.percentile(latencies, 95)),
+            'p99_ms': float(np.percentile(latencies, 99)),
+            'throughput_rps': len(latencies) / elapsed if elapsed else None,
+            'elapsed_s': elapsed,
+            'peak_memory_mb': peak / 2**20 if peak else None,
+            'memory_mb': last / 2**20 if last else None,
+        })
+    return rows
+
+
+def print_report(rows):
+    columns = ['scenario', 'status', 'requests', 'p50_ms', 'p95_ms', 'p99_ms',
+               'throughput_rps', 'peak_memory_mb', 'memory_mb']
+    print(' '.join('{:>14}'.format(col) for col in columns))
+    for row in rows:
+        print(' '.join('{:>14}'.format('-' if row[col] is None else
+                                        '{:.1f}'.format(row[col]) if isinstance(row[col], float) else str(row[col]))
+                       for col in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Load test of the Dash callbacks of the QTO app with concurrent simulated sessions')
+    parser.add_argument('--url', help='URL of a running app, by default the app is started locally')
+    parser.add_argument('--pid', type=int, help='process id of the running app, to measure its memory')
+    parser.add_argument('--server', choices=['flask', 'gunicorn'], default='flask')
+    parser.add_argument('--workers', type=int, default=1, help='gunicorn workers')
+    parser.add_argument('--port', type=int, default=8051)
+    parser.add_argument('--sessions', type=int, default=5, help='concurrent simulated sessions')
+    parser.add_argument('--repeat', type=int, default=1, help='runs of each scenario by each session')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--dataset', default='UF',
+                        help='UF to upload a synthetic dataset, or a preloaded dataset (H1, H2)')
+    parser.add_argument('--elements', type=int, default=10000, help='elements of the synthetic dataset')
+    parser.add_argument('--extra-columns', type=int, default=50,
+                        help='parameters of the synthetic CSV that the takeoff does not use')
+    parser.add_argument('--typing-interval', type=float, default=0.15,
+                        help='seconds between keystrokes in the regex scenario')
+    parser.add_argument('--json', help='file to save the results as JSON')
+    args = parser.parse_args()
+
+    process = None
+    sessions = []
+    url = args.url.rstrip('/') if args.url else 'http://127.0.0.1:{}'.format(args.port)
+    pid = args.pid
+    tmp = tempfile.TemporaryDirectory(prefix='qto_loadtest_')
+    try:
+        if not args.url:
+            process = start_server(args.server, args.port, args.workers)
+            pid = process.pid
+        wait_for_server(url)
+
+        files = None
+        if args.dataset == 'UF':
+            print('Writing a synthetic dataset of {:,} elements...'.format(args.elements))
+            files = make_synthetic_dataset(tmp.name, elements=args.elements,
+                                           extra_columns=args.extra_columns)
+
+        callbacks = get_callbacks(url)
+        layout_props = collect_props(requests.get(url + '/_dash-layout', timeout=30).json())
+        sessions = [Session(url, callbacks, layout_props, args.dataset, files)
+                    for _ in range(args.sessions)]
+
+        rows = []
+        for scenario in args.scenarios:
+            for session in sessions:
+                session.timings = []
+            sampler = MemorySampler(pid)
+            sampler.start()
+            started = time.perf_counter()
+
+            def run(session):
+                for _ in range(args.repeat):
+                    if scenario == 'regex':
+                        session.run_regex(args.typing_interval)
+                    else:
+                        getattr(session, 'run_' + scenario)()
+
+            with ThreadPoolExecutor(max_workers=len(sessions)) as pool:
+                list(pool.map(run, sessions))
+            elapsed = time.perf_counter() - started
+            timings = [t for session in sessions for t in session.timings]
+            rows.extend(summarize(scenario, timings, elapsed, sampler.stop()))
+            print('{}: {} requests in {:.1f} s'.format(scenario, len(timings), elapsed))
+
+        print()
+        print('{} sessions, {} against {}'.format(args.sessions, args.dataset, url))
+        print_report(rows)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump({'args': vars(args), 'results': rows}, f, indent=2)
+    finally:
+        if process is not None:
+            os.killpg(process.pid, signal.SIGTERM)
+            process.wait()
+            # Files uploaded by the simulated sessions to the local app
+            for session in sessions:
+                shutil.rmtree(PATH / 'uploads' / session.upload_id, ignore_errors=True)
+        tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+# Bounding boxes of the DAE elements in meters with the vertical axis z, for
+# each up axis of COLLADA. Run with "python -m pytest" from the app folder
+
+import numpy as np
+import pytest
+
+from app import read_dae_boxes
+
+# One element: a mesh with x in [1, 2], y in [3, 4] and z in [5, 6]
+DAE = '''<?xml version="1.0" encoding="utf-8"?>
+<COLLADA xmlns="http://www.collada.org/2005/11/COLLADASchema" version="1.4.1">
+  <asset><unit meter="1"/><up_axis>{up_axis}</up_axis></asset>
+  <library_geometries>
+    <geometry id="g1">
+      <mesh>
+        <source id="g1-positions">
+          <float_array id="g1-array" count="6">1 3 5 2 4 6</float_array>
+        </source>
+        <vertices id="g1-vertices"><input semantic="POSITION" source="#g1-positions"/></vertices>
+      </mesh>
+    </geometry>
+  </library_geometries>
+  <library_visual_scenes>
+    <visual_scene id="scene">
+      <node id="101"><instance_geometry url="#g1"/></node>
+    </visual_scene>
+  </library_visual_scenes>
+</COLLADA>
+'''
+
+
+@pytest.mark.parametrize('up_axis, mins, maxs', [
+    ('Z_UP', [1, 3, 5], [2, 4, 6]),
+    ('Y_UP', [1, -6, 3], [2, -5, 4]),
+    ('X_UP', [-4, -6, 1], [-3, -5, 2]),
+])
+def test_read_dae_boxes_up_axis(tmp_path, up_axis, mins, maxs):
+    filedae = tmp_path / 'model.dae'
+    filedae.write_text(DAE.format(up_axis=up_axis))
+    ids, box_mins, box_maxs = read_dae_boxes(filedae)
+    assert list(ids) == ['101']
+    np.testing.assert_allclose(box_mins, [mins])
+    np.testing.assert_allclose(box_maxs, [maxs])
@@ -0,0 +1,48 @@
+# Refinement of the elements matched by the previous regular expression of a
+# session. Run with "python -m pytest" from the app folder
+
+import pandas as pd
+import pytest
+
+import app
+from app import is_refinement, select_elements, select_session_elements
+
+TYPES = [
+    'Walls: Basic Wall: Exterior 300', 'Walls: Basic Wall: Interior 120',
+    'Walls: Curtain Wall: CW1', 'Windows: Window: 900x1200', 'Windows: window: W2',
+    'Floors: Floor: 200mm', 'x', 'xy', 'ay', 'y', None,
+]
+
+
+@pytest.fixture(params=['object', 'category'])
+def df(request):
+    return pd.DataFrame({'Type': pd.Series(TYPES * 3, dtype=request.param)})
+
+
+@pytest.mark.parametrize('previous, regexq', [
+    ('*Basic', '*Basic Wall'),
+    ('*Basic', '*Basic Wall: Ext'),
+    ('*[wW]', '*[wW]indow'),
+    ('x|', 'x|y'),
+    ('', 'alls'),
+    ('*Window', '*Window: 9'),
+])
+def test_refined_matches_full_scan(df, previous, regexq):
+    app.session_matches.clear()
+    assert is_refinement(previous, regexq)
+    select_session_elements('session', 'key', df, 'Type', previous)
+    refined = select_session_elements('session', 'key', df, 'Type', regexq)
+    assert refined.equals(select_elements(df, 'Type', regexq))
+
+
+@pytest.mark.parametrize('previous, regexq', [
+    ('*[wW', '*[wWa'),
+    ('*Wall\\', '*Wall\\s'),
+    ('*(W)\\1', '*(W)\\10'),
+    ('*a{2', '*a{2}'),
+    ('*Wall', '*Wall*'),
+    ('*Wall', '*Wall|Floor'),
+    ('*Wall', '*Floor'),
+])
+def test_rejected_refinements(previous, regexq):
+    assert not is_refinement(previous, regexq)
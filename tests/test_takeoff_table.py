@@ -0,0 +1,39 @@
+# Takeoff of a project of linked models where one model has no grouped elements.
+# Run with "python -m pytest" from the app folder
+
+import pandas as pd
+import pytest
+
+import app
+from app import MODEL_COLUMN, get_group_ids, get_takeoff_results, read_models, select_takeoff
+
+MODELS = {
+    'AR': ['Basic Wall: Exterior 300', 'Basic Wall: Interior 120', 'Floor: 200mm'],
+    'ST': ['Basic Wall: Exterior 300', 'Column: 400x400'],
+    'MEP': ['Duct: Round 200', 'Pipe: Steel 50'],
+}
+
+
+@pytest.mark.parametrize('mode', ['compact', 'full'])
+def test_unmatched_model_has_no_group(tmp_path, monkeypatch, mode):
+    monkeypatch.setattr(app, 'INGEST_MODE', mode)
+    files = []
+    for model, types in MODELS.items():
+        file = tmp_path / (model + '.csv')
+        pd.DataFrame({
+            'Category': [t.split(':')[0] for t in types],
+            'Type': types,
+            'Volume': ['{} m3'.format(i + 1) for i in range(len(types))],
+        }).to_csv(file)
+        files.append(file)
+
+    df = read_models(files, columns=['Type'])[0]
+    group_mask = select_takeoff(df, 'Type', '*Basic Wall')
+    table = get_takeoff_results(df, group_mask, 'Type', 'Volume', '*Basic Wall')['table']
+    models = [row[table['columns'].index(MODEL_COLUMN)] for row in table['data']]
+    counts = [row[table['columns'].index('Number of elements')] for row in table['data']]
+
+    assert 'MEP' not in models
+    assert sorted(set(models)) == ['AR', 'All models', 'ST']
+    assert all(isinstance(count, int) for count in counts)
+    assert get_group_ids(df, group_mask) == {'AR': ['0', '1'], 'ST': ['0']}